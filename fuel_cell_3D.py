@@ -1,8 +1,21 @@
+import os
+from typing import NamedTuple
+
 import streamlit as st
 import numpy as np
-import pandas as pd
 import plotly.graph_objects as go
 
+# Plotly.js draws with 32-bit floats anyway. float32 only shrinks the JSON payload when
+# orjson is installed (plotly uses it automatically): it writes float32 values in their
+# shortest form, while the stock json engine expands them (0.9 -> 0.8999999761581421)
+F32 = np.float32
+
+# Layout aesthetics
+SCENE_LAYOUT = dict(scene=dict(xaxis=dict(visible=False), yaxis=dict(visible=False), zaxis=dict(visible=False)),
+                    margin=dict(l=0, r=0, t=40, b=0),
+                    showlegend=False,
+                    paper_bgcolor='rgba(0,0,0,0)')
+
 st.set_page_config(page_title="3D Fuel Cell Virtual Lab", layout="wide")
 
 st.title("3D Hydrogen Fuel Cell — Interactive Virtual Lab 🔋🌐")
@@ -35,81 +48,149 @@ current_density = max(0.01, rate * (Voltage / 1.0) * 0.5)
 power = current_density * Voltage * 50  # assume area ~50 cm^2 for display
 
 # ---- Build 3D schematic ----
-def create_box(x0, x1, y0, y1, z0, z1, color):
-    # return vertices for Mesh3d (a rectangular box)
-    x = [x0,x1,x1,x0,x0,x1,x1,x0]
-    y = [y0,y0,y1,y1,y0,y0,y1,y1]
-    z = [z0,z0,z0,z0,z1,z1,z1,z1]
-    i = [0,0,0,4,4,4,1,2,5,6,1,5]
-    j = [1,2,3,5,6,7,5,6,6,7,4,2]
-    k = [2,3,0,6,7,4,2,3,7,4,5,6]
-    return dict(x=x, y=y, z=z, i=i, j=j, k=k, color=color, opacity=0.9)
+def create_box(x0, x1, y0, y1, z0, z1):
+    # return vertex and triangle index arrays for a rectangular box
+    x = np.asarray([x0,x1,x1,x0,x0,x1,x1,x0], dtype=F32)
+    y = np.asarray([y0,y0,y1,y1,y0,y0,y1,y1], dtype=F32)
+    z = np.asarray([z0,z0,z0,z0,z1,z1,z1,z1], dtype=F32)
+    i = np.asarray([0,0,0,4,4,4,1,2,5,6,1,5], dtype=np.int32)
+    j = np.asarray([1,2,3,5,6,7,5,6,6,7,4,2], dtype=np.int32)
+    k = np.asarray([2,3,0,6,7,4,2,3,7,4,5,6], dtype=np.int32)
+    return x, y, z, i, j, k
 
 # Boxes: Anode, Membrane, Cathode
-anode = create_box(-2.0, -0.5, -0.8, 0.8, -0.5, 0.5, 'lightskyblue')
-membrane = create_box(-0.4, 0.4, -0.9, 0.9, -0.5, 0.5, 'white')
-cathode = create_box(0.5, 2.0, -0.8, 0.8, -0.5, 0.5, 'lightcoral')
-
-fig = go.Figure()
-
-# Add mesh boxes
-fig.add_trace(go.Mesh3d(**anode, name='Anode'))
-fig.add_trace(go.Mesh3d(**membrane, name='Membrane (Electrolyte)'))
-fig.add_trace(go.Mesh3d(**cathode, name='Cathode'))
-
-# Add labels as scatter3d points
-fig.add_trace(go.Scatter3d(x=[-1.25], y=[0], z=[0.7], mode='text', text=['Anode'], textposition='top center'))
-fig.add_trace(go.Scatter3d(x=[0.0], y=[0], z=[0.7], mode='text', text=['Electrolyte'], textposition='top center'))
-fig.add_trace(go.Scatter3d(x=[1.25], y=[0], z=[0.7], mode='text', text=['Cathode'], textposition='top center'))
-
-# Electron path (external wire) - a semicircle above the cell
-theta = np.linspace(-np.pi/2, np.pi/2, 40)
-wire_x = 1.2 * np.cos(theta)
-wire_y = 1.6 * np.sin(theta) * 0.4
-wire_z = np.full_like(theta, 0.9)
-
-fig.add_trace(go.Scatter3d(x=wire_x, y=wire_y, z=wire_z, mode='lines', line=dict(color='gold', width=6), name='External wire'))
-
-# Particles positions (initial)
-n_particles = 12
-t = np.linspace(0, 1, n_particles, endpoint=False)
+BOXES = [
+    ((-2.0, -0.5, -0.8, 0.8, -0.5, 0.5), 'lightskyblue', 'Anode'),
+    ((-0.4, 0.4, -0.9, 0.9, -0.5, 0.5), 'white', 'Membrane (Electrolyte)'),
+    ((0.5, 2.0, -0.8, 0.8, -0.5, 0.5), 'lightcoral', 'Cathode'),
+]
+
+class Paths(NamedTuple):
+    wire: np.ndarray    # (N, 3) electron path along the external wire
+    proton: np.ndarray  # (N, 3) proton path through the membrane
+    t: np.ndarray       # particle phases in [0, 1)
+
+@st.cache_data(show_spinner=False)
+def build_paths(n_particles=12):
+    # Electron path (external wire) - a semicircle above the cell
+    theta = np.linspace(-np.pi/2, np.pi/2, 40)
+    wire = np.stack([1.2 * np.cos(theta),
+                     1.6 * np.sin(theta) * 0.4,
+                     np.full_like(theta, 0.9)], axis=1).astype(F32)
+    # protons path (through membrane): simple straight line from anode->cathode through membrane
+    proton = np.stack([np.linspace(-0.4, 0.4, 40),
+                       np.zeros(40),
+                       np.linspace(-0.3, 0.3, 40)], axis=1).astype(F32)
+    t = np.linspace(0, 1, n_particles, endpoint=False, dtype=F32)
+    return Paths(wire, proton, t)
+
+@st.cache_data(show_spinner=False)
+def oxygen_cloud(n=10):
+    # Oxygen clouds at cathode (visual only); fixed seed so the cloud is stable across reruns
+    rng = np.random.default_rng(0)
+    return (rng.normal(1.4, 0.08, n).astype(F32),
+            rng.normal(0, 0.3, n).astype(F32),
+            rng.normal(0.2, 0.05, n).astype(F32))
+
+@st.cache_data(show_spinner=False)
+def build_static_traces():
+    # Slider-independent part of the scene (boxes, labels, wire) as plain trace dicts
+    boxes = [create_box(*bounds) for bounds, _, _ in BOXES]
+    # Add all boxes as a single mesh (one WebGL draw call); triangle indices of each
+    # box are offset by the number of vertices that precede it
+    box_x = np.concatenate([b[0] for b in boxes])
+    box_y = np.concatenate([b[1] for b in boxes])
+    box_z = np.concatenate([b[2] for b in boxes])
+    box_i = np.concatenate([b[3] + 8*n for n, b in enumerate(boxes)])
+    box_j = np.concatenate([b[4] + 8*n for n, b in enumerate(boxes)])
+    box_k = np.concatenate([b[5] + 8*n for n, b in enumerate(boxes)])
+    box_colors = [color for _, color, _ in BOXES for _ in range(8)]
+    box_names = [part for _, _, part in BOXES for _ in range(8)]  # hover shows the part name
+    wire_x, wire_y, wire_z = build_paths().wire.T
+    traces = [
+        go.Mesh3d(x=box_x, y=box_y, z=box_z, i=box_i, j=box_j, k=box_k,
+                  vertexcolor=box_colors, text=box_names, hoverinfo='text',
+                  flatshading=True, opacity=0.9),
+        # labels as scatter3d points
+        go.Scatter3d(x=[-1.25], y=[0], z=[0.7], mode='text', text=['Anode'], textposition='top center'),
+        go.Scatter3d(x=[0.0], y=[0], z=[0.7], mode='text', text=['Electrolyte'], textposition='top center'),
+        go.Scatter3d(x=[1.25], y=[0], z=[0.7], mode='text', text=['Cathode'], textposition='top center'),
+        go.Scatter3d(x=wire_x, y=wire_y, z=wire_z, mode='lines', line=dict(color='gold', width=6), name='External wire'),
+    ]
+    return [tr.to_plotly_json() for tr in traces]
+
+# Number of electrons/protons shown grows with the reaction rate, matching the
+# "more electrons & protons" hint (9 per species at the default settings, rate ~1.1)
+PARTICLES_PER_RATE = 8
+MIN_PARTICLES, MAX_PARTICLES = 4, 12
+
+# Particle phases along their paths.
+# The paths are (N, 3) lookup tables so particle positions are a single gather.
+n_particles = int(np.clip(round(PARTICLES_PER_RATE * rate), MIN_PARTICLES, MAX_PARTICLES))
+paths = build_paths(n_particles)
 # electron positions along wire parameterized by t
 def electron_positions(t_vals, speed_factor=1.0):
     # shift based on time & speed
     ph = (t_vals * speed_factor) % 1.0
-    idx = (ph * (len(wire_x)-1)).astype(int)
-    return wire_x[idx], wire_y[idx], wire_z[idx]
-
-# protons path (through membrane): simple straight line from anode->cathode through membrane
-proton_x = np.linspace(-0.4, 0.4, 40)
-proton_y = np.zeros_like(proton_x)
-proton_z = np.linspace(-0.3, 0.3, 40)
+    idx = (ph * (len(paths.wire)-1)).astype(np.intp)
+    return paths.wire[idx].T
 
-# initial scatter traces for particles
-ex, ey, ez = electron_positions(t, speed)
-fig.add_trace(go.Scatter3d(x=ex, y=ey, z=ez, mode='markers', marker=dict(size=4, color='blue'), name='Electrons'))
+# proton positions along the membrane path, linearly interpolated between path points
+def proton_positions(t_vals):
+    f = t_vals * (len(paths.proton)-1)
+    i0 = f.astype(np.intp)
+    frac = (f - np.floor(f))[:, None]  # stays float32, unlike f - i0
+    return (paths.proton[i0] * (1 - frac) + paths.proton[i0 + 1] * frac).T
 
-px = np.interp(t, np.linspace(0,1,len(proton_x)), proton_x)
-py = np.interp(t, np.linspace(0,1,len(proton_x)), proton_y)
-pz = np.interp(t, np.linspace(0,1,len(proton_x)), proton_z)
-fig.add_trace(go.Scatter3d(x=px, y=py, z=pz, mode='markers', marker=dict(size=4, color='red'), name='Protons (H+)'))
+# ---- Animation (simulated by re-drawing with new particle positions) ----
+# We'll update particle positions each rerun (Streamlit does not support full continuous animation by default
+# without a server-side loop; we emulate motion by jittering particle positions based on a seed
+# and forcing rerun when slider changes).
 
-# Oxygen clouds at cathode (visual only)
-ox_x = np.random.normal(1.4, 0.08, 10)
-ox_y = np.random.normal(0, 0.3, 10)
-ox_z = np.random.normal(0.2, 0.05, 10)
-fig.add_trace(go.Scatter3d(x=ox_x, y=ox_y, z=ox_z, mode='markers', marker=dict(size=5, color='green', opacity=0.6), name='Oxygen (O2)'))
-
-# Layout aesthetics
-fig.update_layout(scene=dict(xaxis=dict(visible=False), yaxis=dict(visible=False), zaxis=dict(visible=False)),
-                  margin=dict(l=0, r=0, t=40, b=0),
-                  showlegend=False,
-                  paper_bgcolor='rgba(0,0,0,0)')
+# Rebuild the figure object only when a control (or this script) changed; other reruns reuse the
+# previous one. It is still serialized and sent by st.plotly_chart on every rerun.
+controls_key = (os.path.getmtime(__file__), H2, O2, Temperature, Voltage, Pressure, speed)
+if st.session_state.get('last_key') != controls_key:
+    seed = int((H2 + O2 + Temperature + Voltage + Pressure) * 1000) % 2**31
+    # electrons slide faster when reaction rate high
+    electron_speed = max(1.0, speed * (1 + rate/4.0))
+    # Knuth multiplicative hash of the seed, scaled to [0, 0.5)
+    t_shift = ((seed * 2654435761) & 0xFFFFFFFF) / 2**32 * 0.5
+
+    # particle positions for this rerun
+    phase = (paths.t + t_shift) % 1.0
+    ex, ey, ez = electron_positions(phase, speed_factor=electron_speed)
+    px, py, pz = proton_positions(phase)
+
+    ox_x, ox_y, ox_z = oxygen_cloud()
+
+    # all particle species in one scatter trace (one draw call), styled per point
+    n_e, n_p, n_o = len(ex), len(px), len(ox_x)
+    sizes = [6]*n_e + [6]*n_p + [5]*n_o
+    colors = ['blue']*n_e + ['red']*n_p + ['rgba(0,128,0,0.6)']*n_o  # oxygen in translucent green
+    labels = ['Electron']*n_e + ['Proton (H+)']*n_p + ['Oxygen (O2)']*n_o
+    particles = go.Scatter3d(x=np.concatenate([ex, px, ox_x]),
+                             y=np.concatenate([ey, py, ox_y]),
+                             z=np.concatenate([ez, pz, ox_z]),
+                             mode='markers',
+                             marker=dict(size=sizes, color=colors),
+                             text=labels,
+                             name='Particles')
+
+    # static scene + particles, added in one call
+    fig = go.Figure()
+    fig.add_traces(build_static_traces() + [particles])
+
+    fig.update_layout(**SCENE_LAYOUT)
+
+    st.session_state['fuel_cell_fig'] = fig
+    st.session_state['last_key'] = controls_key
+fig = st.session_state['fuel_cell_fig']
 
 # Right-side explanation area
 col1, col2 = st.columns([2,1])
 with col1:
-    chart = st.plotly_chart(fig, use_container_width=True, sharing='streamlit', height=600)
+    st.plotly_chart(fig, use_container_width=True)
 with col2:
     st.header("Explanation & Readouts")
     st.markdown("**Parts:**")
@@ -129,36 +210,3 @@ with col2:
     st.markdown("---")
     st.subheader("Click any part in the 3D view")
     st.write("Clicking a mesh will highlight it; use the controls to study behavior.")
-
-# ---- Animation update loop (simulated by re-drawing with new particle positions) ----
-# We'll update particle positions each rerun (Streamlit does not support full continuous animation by default
-# without a server-side loop; we emulate motion by jittering particle positions based on a random seed
-# and forcing rerun when slider changes).
-seed = int((H2 + O2 + Temperature + Voltage + Pressure) * 1000) % 2**31
-rng = np.random.RandomState(seed)
-# electrons slide faster when reaction rate high
-electron_speed = max(1.0, speed * (1 + rate/4.0))
-t_shift = (rng.rand() * 0.5)
-
-ex, ey, ez = electron_positions((t + t_shift) % 1.0, speed_factor=electron_speed)
-# update traces by constructing a new figure (simple method)
-fig2 = fig.data[:]  # shallow copy of traces
-# replace electron and proton traces (they are at indices after the meshes & labels & wire)
-# find indices by name
-names = [tr.name for tr in fig2]
-elec_idx = names.index('Electrons')
-prot_idx = names.index('Protons (H+)')
-oxy_idx = names.index('Oxygen (O2)')
-
-fig2[elec_idx] = go.Scatter3d(x=ex, y=ey, z=ez, mode='markers', marker=dict(size=6, color='blue'), name='Electrons')
-px = np.interp(((t + t_shift) % 1.0), np.linspace(0,1,len(proton_x)), proton_x)
-py = np.interp(((t + t_shift) % 1.0), np.linspace(0,1,len(proton_x)), proton_y)
-pz = np.interp(((t + t_shift) % 1.0), np.linspace(0,1,len(proton_x)), proton_z)
-fig2[prot_idx] = go.Scatter3d(x=px, y=py, z=pz, mode='markers', marker=dict(size=6, color='red'), name='Protons (H+)')
-
-fig3 = go.Figure(data=fig2)
-fig3.update_layout(scene=dict(xaxis=dict(visible=False), yaxis=dict(visible=False), zaxis=dict(visible=False)),
-                  margin=dict(l=0, r=0, t=40, b=0), paper_bgcolor='rgba(0,0,0,0)')
-
-# re-render updated figure
-chart.plotly_chart(fig3, use_container_width=True)